@@ -4,7 +4,8 @@ import argparse
 from datetime import datetime
 import json
 import math
-from operator import mod
+import os
+import numpy as np
 from ortools.sat.python import cp_model
 
 
@@ -23,6 +24,7 @@ Constraints:
     1) bench roster per round must be equal to num_bench players
     2) Each player must sit on bench between min and max number of times
     3) Each player must play a minimal number of games before sitting on bench again
+    players are sorted by bench presence to break the symmetry between players
 
 Objective:
     Minimize the number of recurring pair of players on bench at the same time
@@ -30,6 +32,14 @@ Objective:
 
 """
 
+def same_bench_count(B):
+    """Count pairs of rounds (r1<r2) where a pair of players (p1<p2) is on bench together
+    B[p, r] is 1 when player p sits on bench in round r"""
+    bench = B.astype(np.int32)
+    # pairs[p1, p2]: number of rounds players p1 and p2 sit on bench together
+    pairs = bench @ bench.T
+    return int(np.triu(pairs*(pairs-1)//2, 1).sum())
+
 class PlayersPartialSolutionPrinter(cp_model.CpSolverSolutionCallback):
     """Print intermediate solutions."""
     def __init__(self, bench, num_players, num_rounds, limit, fname):
@@ -40,61 +50,53 @@ class PlayersPartialSolutionPrinter(cp_model.CpSolverSolutionCallback):
         self._num_rounds = num_rounds
         self._solution_count = 0
         self._solution_limit = limit
+        # solution index of each bench variable: self._idx[p, r] for bench[p][r]
+        self._idx = np.array([[var.Index() for var in row] for row in bench], dtype=np.int64)
 
     def on_solution_callback(self):
         """Print the current solution."""
         self._solution_count += 1
         print(f'Solution {self._solution_count}')
-        self.print_schedule()
-        self.print_player_stat()
-        self.write_bench(self._fname)
+        B = self._snapshot()
+        self.print_schedule(B)
+        self.print_player_stat(B)
+        self.write_bench(B, self._fname)
         if self._solution_count >= self._solution_limit:
             print(f'Stop search after {self._solution_limit} solutions')
             self.StopSearch()
 
-    def print_schedule(self):
+    def _snapshot(self):
+        """Return the bench values: B[p, r] is 1 when player p sits on bench in round r"""
+        value = self.SolutionBooleanValue
+        return np.array([value(i) for i in self._idx.ravel().tolist()], dtype=np.int8).reshape(self._idx.shape)
+
+    def print_schedule(self, B):
         """Print the bench schedule"""
         print(' '.ljust(11), ' On bench')
         for round in range(self._num_rounds):
-            bench = []
-            for player in range(self._num_players):
-                if self.Value(self._bench[(player, round)]):
-                    bench.append(player+1)
+            bench = (np.flatnonzero(B[:, round])+1).tolist()
             print(f' round {round:4}:   {bench}' )
 
-    def write_bench(self,fname):
+    def write_bench(self, B, fname):
         """Print the tournament schedule"""
-        bench = []
-        for round in range(self._num_rounds):
-            for player in range(self._num_players):
-                if self.Value(self._bench[(player, round)]):
-                    bench.append(player+1)
+        # players on bench, round after round (B.T is indexed by [round, player])
+        bench = (np.flatnonzero(B.T) % self._num_players + 1).tolist()
 
         with open(fname, 'w') as filehandle: 
             json.dump(bench, filehandle)
 
-    def print_player_stat(self):
-        sameplayers=0
-        for p1 in range(self._num_players):
-            for p2 in range(p1+1, self._num_players):
-                for r1 in range(self._num_rounds):
-                    for r2 in range(r1+1,self._num_rounds):
-                        p1r1 = self.Value(self._bench[(p1, r1)])
-                        p2r1 = self.Value(self._bench[(p2, r1)])
-                        p1r2 = self.Value(self._bench[(p1, r2)])
-                        p2r2 = self.Value(self._bench[(p2, r2)])
-                        if p1r1+p2r1+p1r2+p2r2 == 4:
-                            sameplayers=sameplayers+1
+    def print_player_stat(self, B):
+        sameplayers = same_bench_count(B)
         time_now = datetime.now().strftime("%H:%M:%S")
         print(f'{time_now} : bench with same players: {sameplayers}')
 
         if 0: # set to 1 if you want more stats information
             for p1 in range(self._num_players):
                 for tr in range(self._num_rounds):
-                    p1r1 = self.Value(self._bench[(p1, r1)])
+                    p1r1 = self.Value(self._bench[p1][r1])
                     for r2 in range(self._num_rounds-1):
-                        rn=mod(r1+1+r2,self._num_rounds)
-                        p1rn = self.Value(self._bench[(p1, rn)])
+                        rn=(r1+1+r2) % self._num_rounds
+                        p1rn = self.Value(self._bench[p1][rn])
                         if p1r1==1 and p1rn==1:
                             print(f' Players {p1:2}: round:{r1}-{rn} numconsec {abs(rn-r1)} ')
     
@@ -154,11 +156,17 @@ def main():
    
     # define basic bench matrix as a boolean var indicating when a player is allocated (true)
     # on the bench in a round
-    # bench[(p, r)]: player 'p' play on round 'r'.
-    bench = {}
-    for player in all_players:
-        for round in all_rounds:
-            bench[(player, round)] = model.NewBoolVar(f'p{player}_t{round}')
+    # bench[p][r]: player 'p' play on round 'r'.
+    bench = [[model.NewBoolVar(f'p{player}_t{round}') for round in all_rounds] for player in all_players]
+
+    # hint the solver with a round robin bench allocation: players sit on bench
+    # in turn, num_bench players per round, and branch on bench variables first
+    for round in all_rounds:
+        benched = [(round*num_bench+b) % num_players for b in range(num_bench)]
+        for player in all_players:
+            model.AddHint(bench[player][round], player in benched)
+    model.AddDecisionStrategy([bench[player][round] for round in all_rounds for player in all_players],
+                              cp_model.CHOOSE_FIRST, cp_model.SELECT_MAX_VALUE)
 
     # constraints on bench matrix
 
@@ -167,7 +175,7 @@ def main():
     for round in all_rounds:
         tmp_players = []
         for player in all_players:
-            tmp_players.append(bench[(player, round)])
+            tmp_players.append(bench[player][round])
         model.Add(sum(tmp_players) == num_bench)
 
     # constraint #2)
@@ -176,56 +184,67 @@ def main():
         for p1 in all_players:
             tmp = []
             for t1 in all_rounds:
-                b_var = model.NewBoolVar(f'b_p{p1}_t{t1}_bench')
-                model.Add(bench[(p1, t1)] == 1).OnlyEnforceIf(b_var)
-                model.Add(bench[(p1, t1)] != 1).OnlyEnforceIf(b_var.Not())
-                tmp.append(b_var)
-            model.Add(sum(tmp) >= min_bench)
-            model.Add(sum(tmp) <= max_bench)
+                tmp.append(bench[p1][t1])
+            model.AddLinearConstraint(sum(tmp), min_bench, max_bench)
 
     # constraint #3)
     if 1:
         # Each player must play a minimal number of games before sitting again on bench.
         # The distance between 2 bench presence must be at least "minimum distance_on_bench"
-        # verified by ensuring that a player is not (sum=0) on bench during "distance_on_bench" rounds
+        # verified by ensuring that a player is on bench at most once (sum<=1) in every
+        # window of "distance_on_bench"+1 consecutive rounds
         for p1 in all_players:
-            tmp = []
             for t1 in all_rounds:
-                for t2 in range(t1+1,t1+1+distance_on_bench):
-                    tn=mod(t2,num_rounds)
-                    #print('5-- ', p1, t1, tn)
-                    b_var = model.NewBoolVar(f'b_p{p1}_t{t1}_t{tn}_bench')
-                    model.Add(bench[(p1, t1)] + bench[(p1, tn)] \
-                        ==  2).OnlyEnforceIf(b_var)
-                    model.Add(bench[(p1, t1)] + bench[(p1, tn)] \
-                        !=  2).OnlyEnforceIf(b_var.Not())
-                    tmp.append(b_var)
-            # ensure that each player is not on bench during "distance_on_bench" rounds
-            # --> sum must be 0
-            model.Add(sum(tmp) ==0)
+                tmp = []
+                for t2 in range(t1,t1+1+distance_on_bench):
+                    tn=t2 % num_rounds
+                    tmp.append(bench[p1][tn])
+                model.Add(sum(tmp) <= 1)
+
+    # symmetry breaking)
+    if 1:
+        # players are interchangeable: any relabeling of players gives an equivalent solution.
+        # Keep only solutions where players are sorted by their bench presence, read as a
+        # binary number (round 0 is the most significant bit). Rounds are not symmetric
+        # (constraint #3 depends on their order) and must not be reordered.
+        # Only the first 30 rounds are used to keep coefficients small; sorting on a prefix
+        # is still satisfied by a fully sorted relabeling.
+        sym_rounds = range(min(num_rounds, 30))
+        rank = []
+        for p1 in all_players:
+            rank.append(sum(bench[p1][t1] * 2**(len(sym_rounds)-1-t1) for t1 in sym_rounds))
+        for p1 in range(num_players-1):
+            model.Add(rank[p1] >= rank[p1+1])
 
     # objective #1)
     if 1:
         # minimize the number of recurring pair of players on bench at the same time
         # ideally, 2 players should not be on bench at the same time more then once 
+        # for each pair of players, count the rounds (c) where both players are on bench:
+        # they share the bench on c*(c-1)/2 pairs of rounds
+        num_round_pairs = [c*(c-1)//2 for c in range(num_rounds+1)]
         tmp = []
         for p1 in all_players:
             for p2 in range(p1+1, num_players):
+                together = []
                 for t1 in all_rounds:
-                    for t2 in range(t1+1,num_rounds):
-                        b_var = model.NewBoolVar(f'b_p{p1}_p{p2}_t{t1}_t{t2}')
-                        model.Add(bench[(p1, t1)] + bench[(p2, t1)] \
-                            + bench[(p1, t2)] + bench[(p2, t2)] ==  4).OnlyEnforceIf(b_var)
-                        model.Add(bench[(p1, t1)] + bench[(p2, t1)] \
-                            + bench[(p1, t2)] + bench[(p2, t2)] !=  4).OnlyEnforceIf(b_var.Not())
-                        tmp.append(b_var)
+                    b_var = model.NewBoolVar(f'b_p{p1}_p{p2}_t{t1}')
+                    model.AddBoolAnd([bench[p1][t1], bench[p2][t1]]).OnlyEnforceIf(b_var)
+                    model.AddBoolOr([bench[p1][t1].Not(), bench[p2][t1].Not()]).OnlyEnforceIf(b_var.Not())
+                    together.append(b_var)
+                c_var = model.NewIntVar(0, num_rounds, f'c_p{p1}_p{p2}')
+                model.Add(c_var == sum(together))
+                pairs_var = model.NewIntVar(0, num_round_pairs[-1], f'n_p{p1}_p{p2}')
+                model.AddElement(c_var, num_round_pairs, pairs_var)
+                tmp.append(pairs_var)
         model.Minimize(sum(tmp))
 
     # Creates the solver and solve.
     solver = cp_model.CpSolver()
     solver.parameters.linearization_level = 2
-    # Enumerate all solutions.
-    solver.parameters.enumerate_all_solutions = True
+    # Search for the optimal solution only (improving solutions are still reported 
+    # to the callback) using all available cores.
+    solver.parameters.num_workers = os.cpu_count() or 1
     solver.parameters.search_branching = cp_model.PORTFOLIO_SEARCH
 
     # Display the first five solutions.
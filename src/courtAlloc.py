@@ -3,7 +3,8 @@ import argparse
 from datetime import datetime
 import json
 import math
-from operator import mod
+import numpy as np
+import os
 import random
 from ortools.sat.python import cp_model
 
@@ -32,13 +33,19 @@ Objective:
 
 """
 
+def court_counts(G, group_assignements):
+    """Return playersCourtCount[c, p], how often (count) player p plays on court c,
+    and playersCourtDiffMax[p], the difference between the max and min courtcount of player p
+    G[r, c, g] is 1 when group g plays on court c in round r"""
+    playersCourtCount = np.einsum('rcg,rgp->cp', G, group_assignements, dtype=np.int32)
+    playersCourtDiffMax = np.ptp(playersCourtCount, axis=0)
+    return playersCourtCount, playersCourtDiffMax
+
 class PlayersPartialSolutionPrinter(cp_model.CpSolverSolutionCallback):
     """Print intermediate solutions."""
-    def __init__(self, games, group_assignements, groupVar, num_players, num_rounds, num_courts, limit, \
+    def __init__(self, games, group_assignements, num_players, num_rounds, num_courts, limit, \
         groups, bench_matrix):
         cp_model.CpSolverSolutionCallback.__init__(self)
-        self._games = games
-        self._groupVar = groupVar
         self._groups = groups
         self._bench_matrix = bench_matrix
         self._group_assignements = group_assignements
@@ -49,56 +56,52 @@ class PlayersPartialSolutionPrinter(cp_model.CpSolverSolutionCallback):
         self._solution_limit = limit
         self._bestCourtDiffMax = num_rounds
         self._numPlayersWith_best = num_players
+        # solution index of each games variable: self._idx[r, c, g] for games[r][c][g]
+        self._idx = np.array([[[var.Index() for var in court] for court in round] for round in games], dtype=np.int64)
 
 
     def on_solution_callback(self):
         """Print the current solution."""
         self._solution_count += 1
-        self.print_schedule()
+        self.print_schedule(self._snapshot())
         if self._solution_count >= self._solution_limit:
             print(f'Stop search after {self._solution_limit} solutions')
             self.StopSearch()
 
 
-    def print_schedule(self):
+    def _snapshot(self):
+        """Return the games values: G[r, c, g] is 1 when group g plays on court c in round r"""
+        value = self.SolutionBooleanValue
+        return np.array([value(i) for i in self._idx.ravel().tolist()], dtype=np.int8).reshape(self._idx.shape)
+
+    def print_schedule(self, G):
         """Print the schedule"""
 
         # playersCourtCount: calculate how often (count) a player plays on each court
-        playersCourtCount={}
-        for court in range(self._num_courts):
-            playersCourtCount[court] = []
-            for player in range(self._num_players):
-                courtCount=0
-                for group in range(self._num_courts):
-                    for round in range(self._num_rounds):
-                        if self.Value(self._games[(round, court, group)]):
-                            if self._group_assignements[round][group][player]:
-                                courtCount=courtCount+1
-                playersCourtCount[court].append(courtCount)
-        
         # playersCourtDiffMax: calculate the difference between the max and min courtcount 
         # for each player 
-        playersCourtDiffMax = []
-        for player in range(self._num_players):
-            maxCount = max(playersCourtCount[court][player] for court in range(self._num_courts))
-            minCount = min(playersCourtCount[court][player] for court in range(self._num_courts))
-            playersCourtDiffMax.append(maxCount-minCount)
+        playersCourtCount, playersCourtDiffMax = court_counts(G, self._group_assignements)
+        courtDiffMax = int(playersCourtDiffMax.max())
+        # a solution worse than the best one found so far is neither reported nor kept
+        if courtDiffMax > self._bestCourtDiffMax:
+            return
+        numPlayersWith = int((playersCourtDiffMax == courtDiffMax).sum())
 
         # keep the new solution if it is better then any previous
         # determined by max(playersCourtDiffMax) and if 
         # max(playersCourtDiffMax) is the same keep less players have 
         # the same CourtDiff 
         printit=False
-        if self._bestCourtDiffMax==max(playersCourtDiffMax):
+        if self._bestCourtDiffMax==courtDiffMax:
             # print some info to verify that other solutions exist
             # with same CourtDiffMax
-            print(f'{max(playersCourtDiffMax)}-{playersCourtDiffMax.count(max(playersCourtDiffMax))}, ') 
-            if self._numPlayersWith_best>=playersCourtDiffMax.count(max(playersCourtDiffMax)):
-                self._numPlayersWith_best=playersCourtDiffMax.count(max(playersCourtDiffMax))
+            print(f'{courtDiffMax}-{numPlayersWith}, ') 
+            if self._numPlayersWith_best>=numPlayersWith:
+                self._numPlayersWith_best=numPlayersWith
                 printit=True
-        if self._bestCourtDiffMax>max(playersCourtDiffMax):
-            self._bestCourtDiffMax=max(playersCourtDiffMax)
-            self._numPlayersWith_best=playersCourtDiffMax.count(max(playersCourtDiffMax))
+        if self._bestCourtDiffMax>courtDiffMax:
+            self._bestCourtDiffMax=courtDiffMax
+            self._numPlayersWith_best=numPlayersWith
             printit=True
 
         # if current solution is a better solution, then print it
@@ -108,36 +111,19 @@ class PlayersPartialSolutionPrinter(cp_model.CpSolverSolutionCallback):
 
             # print court counts for each player
             print(f'              Players ' )    
-            groupAssigned= {}
             for court in range(self._num_courts):
-                groupAssigned[court] = []
-                for player in range(self._num_players):
-                    count=0
-                    for group in range(self._num_courts):
-                        for round in range(self._num_rounds):
-                            v1=self.Value(self._games[(round, court, group)])
-                            v2=self.Value(self._groupVar[(round, group, player)])
-                            #print(court,player,group,round,v1,v2,count)
-                            if v1+v2==2:
-                                count=count+1
-                    groupAssigned[court].append( count ) 
                 # print current court counts per players
-                print(f' Court   {court:4}:  {groupAssigned[court]}' )    
-            print(f' MaxDiff     :  {playersCourtDiffMax}') 
-            print(f' Max difference: {max(playersCourtDiffMax):2} for {self._numPlayersWith_best} players') 
+                print(f' Court   {court:4}:  {playersCourtCount[court].tolist()}' )    
+            print(f' MaxDiff     :  {playersCourtDiffMax.tolist()}') 
+            print(f' Max difference: {courtDiffMax:2} for {self._numPlayersWith_best} players') 
 
             # print court and bench player assignments            
             print(' '.ljust(14), ' '.join([f'court {i+1:2}'.ljust(19) for i in range(self._num_courts)]), 'bench'.ljust(10))
-            playersAssigned={}
+            # courtGroup[r, c]: group of players playing on court c in round r
+            courtGroup = G.argmax(axis=2).tolist()
             for round in range(self._num_rounds):
                 group_ass = self._groups[round]
-                for court in range(self._num_courts):
-                    for group in range(self._num_courts):
-                        groupMembers=group_ass[f'{group}']
-                        if self.Value(self._games[(round, court, group)]):
-                            playersAssigned[court] = groupMembers
-                            #print(round, court, group, groupMembers)
-                str_games = [f'{v}'.ljust(18) for v in playersAssigned.values()]
+                str_games = [f'{group_ass[group]}'.ljust(18) for group in courtGroup[round]]
                 str_bench = [f' {self._bench_matrix[round]}'.ljust(30)]
                 print(f' Round {round+1:4}:  ', '  '.join(str_games), ' '.join(str_bench) )
 
@@ -202,9 +188,7 @@ def main():
 
     rand_players=list(range(num_players))
     random.shuffle(rand_players)
-    groupVar = {}
     duoVar = {}
-    games = {}
 
 
     bench_list = []
@@ -229,11 +213,9 @@ def main():
 
     # define basic game matrix as a boolean var indicating when a group of players
     # is allocated (true) on a specific court in a round
-    # games[(r, c, g)]: group of players 'g' play on court 'c' in round 'r'.
-    for round in all_rounds:
-        for court in all_played_courts:
-            for group in all_played_courts:
-                games[(round, court, group)] = model.NewBoolVar(f'r{round}_c{court}_g{group}')
+    # games[r][c][g]: group of players 'g' play on court 'c' in round 'r'.
+    games = [[[model.NewBoolVar(f'r{round}_c{court}_g{group}') for group in all_played_courts]
+              for court in all_played_courts] for round in all_rounds]
 
     # constraints on game matrix
 
@@ -243,8 +225,8 @@ def main():
         for group in all_played_courts:
             tmp_courts = []
             for court in all_played_courts:
-                tmp_courts.append(games[(round, court, group)])
-            model.Add(sum(tmp_courts) == 1)
+                tmp_courts.append(games[round][court][group])
+            model.AddExactlyOne(tmp_courts)
 
     # constraint #2) 
     # in each round, each court is assigned to exactly 1 group.
@@ -252,8 +234,14 @@ def main():
         for court in all_played_courts:
             tmp_groups = []
             for group in all_played_courts:
-                tmp_groups.append(games[(round, court, group)])
-            model.Add(sum(tmp_groups) == 1)
+                tmp_groups.append(games[round][court][group])
+            model.AddExactlyOne(tmp_groups)
+
+    # symmetry breaking)
+    # courts are interchangeable: renaming courts in every round gives the same court counts.
+    # Keep only solutions where group g plays on court g in the first round.
+    for group in all_played_courts:
+        model.Add(games[0][group][group] == 1)
 
     # explicitly assign group of players in each round
     # based on input file information
@@ -262,28 +250,54 @@ def main():
     with open(f'groups_{fname}', 'r') as filehandle:
         groups = json.load(filehandle)
 
-    group_assignements = [[ [0 for _ in all_players] for _ in all_played_courts] for _ in all_rounds]
+    # group_assignements[r, g, p] is 1 when player 'p' belongs to group 'g' in round 'r'
+    group_assignements = np.zeros((num_rounds, num_courts, num_players), dtype=np.int8)
     for round in all_rounds:
         group_ass = groups[round]
         for group in all_played_courts:
-            groupMembers=group_ass[f'{group}']
+            groupMembers=group_ass[group]
             for member in range(num_players_per_court):
                 player=groupMembers[member]-1
-                group_assignements[round][group][player]=1
+                group_assignements[round, group, player]=1
     #print(group_assignements)
 
-    for round in all_rounds:
-        for group in all_played_courts:
-            for player in all_players:
-                groupVar[(round, group, player)] = model.NewBoolVar(f'r{round}_g{group}_p{player}')
-                model.Add(groupVar[(round, group, player)]== group_assignements[round][group][player])
+    # objective #1)
+    if 1:
+        # playersCourtCount: how often (count) a player plays on each court
+        # playersCourtDiff: difference between the max and min courtcount for each player
+        # minimize the max of playersCourtDiff and then the number of players having this max
+        playersCourtDiff = []
+        for player in all_players:
+            playersCourtCount = []
+            for court in all_played_courts:
+                count_var = model.NewIntVar(0, num_rounds, f'n_c{court}_p{player}')
+                model.Add(count_var == sum(games[round][court][group] for round in all_rounds
+                    for group in all_played_courts if group_assignements[round, group, player]))
+                playersCourtCount.append(count_var)
+            max_var = model.NewIntVar(0, num_rounds, f'max_p{player}')
+            min_var = model.NewIntVar(0, num_rounds, f'min_p{player}')
+            model.AddMaxEquality(max_var, playersCourtCount)
+            model.AddMinEquality(min_var, playersCourtCount)
+            diff_var = model.NewIntVar(0, num_rounds, f'diff_p{player}')
+            model.Add(diff_var == max_var - min_var)
+            playersCourtDiff.append(diff_var)
+        courtDiffMax = model.NewIntVar(0, num_rounds, 'diff_max')
+        model.AddMaxEquality(courtDiffMax, playersCourtDiff)
+        # atMax[p] must be set when player p reaches the max difference
+        atMax = []
+        for player in all_players:
+            b_var = model.NewBoolVar(f'b_p{player}_max')
+            model.Add(playersCourtDiff[player] < courtDiffMax).OnlyEnforceIf(b_var.Not())
+            atMax.append(b_var)
+        model.Minimize(courtDiffMax*(num_players+1) + sum(atMax))
 
 
     # Creates the solver and solve.
     solver = cp_model.CpSolver()
     solver.parameters.linearization_level = 2
-    # Enumerate all solutions.
-    solver.parameters.enumerate_all_solutions = True
+    # Search for the optimal solution only (improving solutions are still reported 
+    # to the callback) using all available cores.
+    solver.parameters.num_workers = os.cpu_count() or 1
     solver.parameters.search_branching = cp_model.PORTFOLIO_SEARCH
     # AUTOMATIC_SEARCH = sat_parameters_pb2.SatParameters.AUTOMATIC_SEARCH
     # FIXED_SEARCH = sat_parameters_pb2.SatParameters.FIXED_SEARCH
@@ -294,7 +308,7 @@ def main():
 
     # Display the first five solutions.
     solution_limit = 500000
-    solution_printer = PlayersPartialSolutionPrinter(games, group_assignements, groupVar, num_players,
+    solution_printer = PlayersPartialSolutionPrinter(games, group_assignements, num_players,
                                                     num_rounds, num_courts,
                                                     solution_limit, groups, bench_matrix)
 
@@ -3,7 +3,7 @@ import argparse
 from datetime import datetime
 import json
 import math
-from operator import mod
+import numpy as np
 import random
 from ortools.sat.python import cp_model
 
@@ -34,129 +34,120 @@ Objective:
 """
 class TeamAllocationSolutionPrinter(cp_model.CpSolverSolutionCallback):
     """Print intermediate solutions."""
-    def __init__(self, games, bench, duoVar, num_players, num_rounds, num_courts, limit, fname):
+    def __init__(self, games, duoVar, num_players, num_rounds, num_courts, limit):
         cp_model.CpSolverSolutionCallback.__init__(self)
-        self._games = games
-        self._duoVar = duoVar
-        self._bench = bench
-        self._fname = fname
         self._num_players = num_players
         self._num_rounds = num_rounds
         self._num_courts = num_courts
         self._solution_count = 0
         self._solution_limit = limit
-        self._best = num_rounds
-        self._better = num_players*(num_players+1)/2
+        # best difference and fewest consecutive games with same players printed so far:
+        # the first solution is always printed
+        self._best = math.inf
+        self._better = math.inf
+        # indices (p1, p2) of the pairs of players p1<p2, in the upper triangle
+        self._pairs = np.triu_indices(num_players, 1)
+        # groups of players of the last printed solution, written once the search is over
+        self._best_groups = []
+        # solution index of each games variable: self._idx[p, r, c] for games[(p, r, c)]
+        self._idx = np.array([[[games[(p, r, c)].Index() for c in range(num_courts+1)]
+                               for r in range(num_rounds)] for p in range(num_players)], dtype=np.int64)
+        # solution index of each duo variable: self._duo_idx[p, r, d] for duoVar[(p, r, d)]
+        self._duo_idx = np.array([[[duoVar[(p, r, d)].Index() for d in range(2*num_courts)]
+                                   for r in range(num_rounds)] for p in range(num_players)], dtype=np.int64)
 
     def on_solution_callback(self):
         """Print the current solution."""
         self._solution_count += 1
-        self.print_schedule()
+        self.print_schedule(self._snapshot())
         if self._solution_count >= self._solution_limit:
             print(f'Stop search after {self._solution_limit} solutions')
             self.StopSearch()
 
-    def print_schedule(self):
+    def _values(self, idx):
+        """Return the values of the solution variables at indices idx, in the shape of idx"""
+        # SolutionBooleanValue() on the bare indices skips the Value() checks and,
+        # unlike Response(), does not copy the whole solution (aux variables included)
+        value = self.SolutionBooleanValue
+        return np.array([value(i) for i in idx.ravel().tolist()], dtype=np.int8).reshape(idx.shape)
+
+    def _snapshot(self):
+        """Return the games values:
+        G[p, r, c] is 1 when player p plays on court c in round r (court num_courts is the bench)"""
+        return self._values(self._idx)
+
+    def _duos(self):
+        """Return the duo values:
+        D[p, r, d] is 1 when player p plays in pair of partners d in round r"""
+        return self._values(self._duo_idx)
+
+    def print_schedule(self, G):
+        P, C = self._num_players, self._num_courts
         # for each pair of players, calculat number of times they play on the same court
-        paircounts = [ [0 for x in range(self._num_players)] for y in range(self._num_players)]
-        for p1 in range(self._num_players):
-            for p2 in range(p1+1, self._num_players):
-                for round in range(self._num_rounds):
-                    for court in range(self._num_courts):
-                        p1rc = self.Value(self._games[(p1, round, court)])
-                        p2rc = self.Value(self._games[(p2, round, court)])
-                        if p1rc+p2rc == 2:
-                            paircounts[p1][p2]=paircounts[p1][p2]+1
+        # (only p1<p2 is kept, in the upper triangle)
+        played = G[:, :, :C]
+        paircounts = np.triu(np.einsum('prc,qrc->pq', played, played, dtype=np.int32), 1)
         
         # and determine max and min count
-        maxCount = max(paircounts[p1][p2] for p1 in range(self._num_players) for p2 in range(p1+1, self._num_players))
-        minCount = min(paircounts[p1][p2] for p1 in range(self._num_players) for p2 in range(p1+1, self._num_players))
+        pairs = paircounts[self._pairs]
+        maxCount = int(pairs.max())
+        minCount = int(pairs.min())
 
         # Minimize the difference between the max and min of this calculation.
         # This way, players will play similar number of times with the same players.
-        printit=False
-        sameplayers=0
-
-        # if current solution is better or equal to previous solutions print/save it.
-        if maxCount-minCount <= self._best :
-            for p1 in range(self._num_players):
-                for p2 in range(p1+1, self._num_players):
-                    for r1 in range(self._num_rounds):
-                            rn=mod(r1+1,self._num_rounds)
-                            for c1 in range(self._num_courts):
-                                for c2 in range(self._num_courts):
-                                    p1r1c1 = self.Value(self._games[(p1, r1, c1)])
-                                    p2r1c1 = self.Value(self._games[(p2, r1, c1)])
-                                    p1rnc2 = self.Value(self._games[(p1, rn, c2)])
-                                    p2rnc2 = self.Value(self._games[(p2, rn, c2)])
-                                    if p1r1c1+p2r1c1+p1rnc2+p2rnc2 == 4:
-                                        sameplayers=sameplayers+1
-                                        #print(f' Players: {p1:2}-{p2:2} round:{r1:2}-{rn:2} courts:{c1:2}-{c2:2} ')
-
+        # A worse difference is never printed: skip the consecutive games count.
+        if maxCount-minCount > self._best:
+            return
+
+        # masks[r, c]: bitmask of the players on court c in round r, packed 8 players per byte
+        masks = np.packbits(played.transpose(1, 2, 0).astype(bool), axis=2)
+        # count pairs of players (p1<p2) sharing a court in 2 consecutive rounds
+        # (the last round is followed by the first one):
+        # k common players on courts c1 and c2 make k*(k-1)/2 pairs
+        common = np.bitwise_count(masks[:, :, None, :] & np.roll(masks, -1, axis=0)[:, None, :, :]) \
+            .sum(axis=3, dtype=np.int32)
+        sameplayers = int((common*(common-1)//2).sum())
+
+        # print/save the current solution if it has a better difference, or the same
+        # difference and no more consecutive games with the same players.
+        if maxCount-minCount < self._best or sameplayers <= self._better:
             self._best = maxCount-minCount
-            if maxCount-minCount < self._best :
-                printit=True
-            if sameplayers <= self._better:
-                printit=True
-                self._better=sameplayers
-
-        if printit:
+            self._better = sameplayers
+            self._best_groups = self.groups(self._duos())
             time_now = datetime.now().strftime("%H:%M:%S")
             print(f'Solution {self._solution_count} @ {time_now}')
             print(f'player pairs :')
-            for player in range(self._num_players):
-                print(paircounts[player])
+            for player in range(P):
+                print(paircounts[player].tolist())
             print(f'{maxCount} {minCount} {self._best}: consecutive games with same players: {self._better}')
             """Print the schedule"""
-            print(' '.ljust(14), ' '.join([f'court {i+1:2}'.ljust(19) for i in range(self._num_courts)]), 'bench'.ljust(10))
+            print(' '.ljust(14), ' '.join([f'court {i+1:2}'.ljust(19) for i in range(C)]), 'bench'.ljust(10))
             
-            for round in range(self._num_rounds):
-                games = {}
-                bench = {}
-                for court in range(self._num_courts):
-                    games[court] = []
-                    pair=court*2
-                    for player in range(self._num_players):
-                        if self.Value(self._duoVar[(player, round, pair)]):
-                            #print(f'  player {player} plays court {court}')
-                            games[court].append(player+1)
-                    #games[court].append("vs")
-                    for player in range(self._num_players):
-                        if self.Value(self._duoVar[(player, round, pair+1)]):
-                            #print(f'  player {player} plays court {court}')
-                            games[court].append(player+1)
-                str_games = [f'{v}'.ljust(18) for v in games.values()]
-                bench = []
-                for player in range(self._num_players):
-                    if self.Value(self._games[(player, round, self._num_courts)]):
-                        #print(f'  player {player} plays court {self._num_courts}')
-                        bench.append(player+1)
+            for round, games in enumerate(self._best_groups):
+                str_games = [f'{v}'.ljust(18) for v in games]
+                bench = (np.flatnonzero(G[:, round, C])+1).tolist()
                 str_bench = [f' {bench}'.ljust(30)]
                 print(f' Round {round+1:4}:  ', '  '.join(str_games), ' '.join(str_bench) )
-                self.write_bench(self._fname)
 
     def solution_count(self):
         """Return number of solution found so far."""
         return self._solution_count
 
-    def write_bench(self,fname):
-        """Print the tournament schedule"""
-        groups = []
-        for round in range(self._num_rounds):
-            games = {}
-            for court in range(self._num_courts):
-                games[court] = []
-                pair=court*2
-                for player in range(self._num_players):
-                    if self.Value(self._duoVar[(player, round, pair)]):
-                        games[court].append(player+1)
-                for player in range(self._num_players):
-                    if self.Value(self._duoVar[(player, round, pair+1)]):
-                        games[court].append(player+1)
-            groups.append(games)
+    def groups(self, D):
+        """Return, for each round, the players of both pairs of partners playing on each court"""
+        # groups[r][c]: players on court c in round r
+        R, C = self._num_rounds, self._num_courts
+        return [[[int(player)+1 for duo in (court*2, court*2+1) for player in np.flatnonzero(D[:, round, duo])]
+                 for court in range(C)] for round in range(R)]
 
+    def has_groups(self):
+        """Return True when a solution has been printed"""
+        return len(self._best_groups) > 0
+
+    def write_bench(self, fname):
+        """Save the groups of players of the last printed solution"""
         with open(fname, 'w') as filehandle: 
-            json.dump(groups, filehandle)
+            json.dump(self._best_groups, filehandle)
 
 def main():
     # validate input and prepare data
@@ -212,7 +203,6 @@ def main():
 
     rand_players=list(range(num_players))
     random.shuffle(rand_players)
-    benchVar = {}
     duoVar = {}
     games = {}
 
@@ -230,20 +220,16 @@ def main():
     # First num_courts on each round is assigned to exactly num_players_per_court players.
     for round in all_rounds:
         for court in all_played_courts:
-            tmp_players = []
-            for player in all_players:
-                tmp_players.append(games[(player, round, court)])
-            model.Add(sum(tmp_players) == num_players_per_court)
+            tmp_players = [games[(player, round, court)] for player in all_players]
+            model.Add(cp_model.LinearExpr.Sum(tmp_players) == num_players_per_court)
 
     # constraint #2) 
     # bench roster (last "court" in matrix) per round must be equal to num_bench players
     if 1:
         for round in all_rounds:
             for court in all_bench:
-                tmp_players = []
-                for player in all_players:
-                    tmp_players.append(games[(player, round, court)])
-                model.Add(sum(tmp_players) == num_bench)
+                tmp_players = [games[(player, round, court)] for player in all_players]
+                model.Add(cp_model.LinearExpr.Sum(tmp_players) == num_bench)
 
     # constraint #3) 
     # Each player must be placed in one playing court or on the bench per round.
@@ -259,26 +245,12 @@ def main():
         with open(fname, 'r') as filehandle:
             bench_list = json.load(filehandle)
 
-        count=0
-        bench_assignements=[ [ 0 for t in all_rounds] for p in all_players ]
-        bench_matrix=[]
         # assign players on bench for each round in the model
+        # (bench_list holds num_bench players per round, round after round)
         for round in all_rounds:
-            bench=[]
-            for _ in range(num_bench):
-                bench.append(bench_list[count])
-                bench_assignements[bench_list[count]-1][round]=1
-                model.Add(games[(bench_list[count]-1, round, benchcourt)]== 1)
-                count=count+1
-            bench_matrix.append(bench)
-
-        # assign players on bench for each round in the model by
-        # defining bench variable and match assignement on games matrice
-        for player in all_players:
-            for round in all_rounds:
-                benchVar[(player, round)] = model.NewBoolVar(f'p{player}_t{round}')
-                model.Add(benchVar[(player, round)]== games[(player, round, benchcourt)]  )
-        
+            for player in bench_list[round*num_bench:(round+1)*num_bench]:
+                model.Add(games[(player-1, round, benchcourt)]== 1)
+
     # constraint #5)
     # every pair of players should play in the same court (with or against eachother) at least once
     if 1:
@@ -287,13 +259,13 @@ def main():
                 tmp = []
                 for round in all_rounds:
                     for court in all_played_courts:
-                        b_var = model.NewBoolVar(f'b_p{p1}_p{p2}_r{round}_c{court}')
-                        model.Add(games[(p1, round, court)] + games[(p2, round, court)] \
-                            ==  2).OnlyEnforceIf(b_var)
-                        model.Add(games[(p1, round, court)] + games[(p2, round, court)] \
-                            !=  2).OnlyEnforceIf(b_var.Not())
+                        # auxiliary variables are never read back: leave them unnamed
+                        b_var = model.NewBoolVar('')
+                        model.AddBoolAnd([games[(p1, round, court)], games[(p2, round, court)]]).OnlyEnforceIf(b_var)
+                        model.AddBoolOr([games[(p1, round, court)].Not(), games[(p2, round, court)].Not()]) \
+                            .OnlyEnforceIf(b_var.Not())
                         tmp.append(b_var)
-                model.Add(sum(tmp) >0)
+                model.AddBoolOr(tmp)
 
     # define each pair of partners (duo) for each court and ensure they refer to a court in the game matrice
     if 1:
@@ -312,13 +284,28 @@ def main():
         for round in all_rounds:
             for court in all_played_courts:
                 pair=court*2
-                tmp_pair1 = []
-                tmp_pair2 = []
+                tmp_pair1 = [duoVar[(player, round, pair)] for player in all_players]
+                tmp_pair2 = [duoVar[(player, round, pair+1)] for player in all_players]
+                model.Add(cp_model.LinearExpr.Sum(tmp_pair1) == 2)
+                model.Add(cp_model.LinearExpr.Sum(tmp_pair2) == 2)
+
+    # symmetry breaking)
+    # courts of a round are interchangeable (courts are assigned later by courtAlloc) and 
+    # so are the 2 pairs of partners on a court.
+    # Keep only solutions where courts of a round are sorted by their lowest player and
+    # where the lowest player of a court is in its first pair:
+    # a player can only be on court c (or in pair+1) if a lower player is on court c-1 (or in pair).
+    if 1:
+        for round in all_rounds:
+            for court in all_played_courts:
+                pair=court*2
                 for player in all_players:
-                    tmp_pair1.append(duoVar[(player, round, pair)])
-                    tmp_pair2.append(duoVar[(player, round, pair+1)])
-                model.Add(sum(tmp_pair1) == 2)
-                model.Add(sum(tmp_pair2) == 2)
+                    lower = range(player)
+                    if court>0:
+                        model.AddBoolOr([games[(p, round, court-1)] for p in lower] \
+                            + [games[(player, round, court)].Not()])
+                    model.AddBoolOr([duoVar[(p, round, pair)] for p in lower] \
+                        + [duoVar[(player, round, pair+1)].Not()])
 
     # constraint #7)
     # every pair of partners should be unique 
@@ -330,38 +317,42 @@ def main():
                 for round in all_rounds:
                     for court in all_played_courts:
                         pair=court*2
-                        b_var = model.NewBoolVar(f'b_p{p1}_p{p2}_t{round}_d{pair}')
-                        model.Add(duoVar[(p1, round, pair)]+ duoVar[(p2, round, pair)] \
-                            ==  2).OnlyEnforceIf(b_var)
-                        model.Add(duoVar[(p1, round, pair)]+ duoVar[(p2, round, pair)] \
-                            !=  2).OnlyEnforceIf(b_var.Not())
-                        tmp.append(b_var)
-                        b_var = model.NewBoolVar(f'b_p{p1}_p{p2}_t{round}_d{pair+1}')
-                        model.Add(duoVar[(p1, round, pair+1)]+ duoVar[(p2, round, pair+1)] \
-                            ==  2).OnlyEnforceIf(b_var)
-                        model.Add(duoVar[(p1, round, pair+1)]+ duoVar[(p2, round, pair+1)] \
-                            !=  2).OnlyEnforceIf(b_var.Not())
-                        tmp.append(b_var)
-                model.Add(sum(tmp) < 2)
+                        for duo in (pair, pair+1):
+                            b_var = model.NewBoolVar('')
+                            model.AddBoolAnd([duoVar[(p1, round, duo)], duoVar[(p2, round, duo)]]) \
+                                .OnlyEnforceIf(b_var)
+                            model.AddBoolOr([duoVar[(p1, round, duo)].Not(), duoVar[(p2, round, duo)].Not()]) \
+                                .OnlyEnforceIf(b_var.Not())
+                            tmp.append(b_var)
+                model.AddAtMostOne(tmp)
 
     # Creates the solver and solve.
     solver = cp_model.CpSolver()
-    solver.parameters.linearization_level = 2
-    # Enumerate all solutions.
+    # the model only holds boolean constraints: no LP relaxation at all, the
+    # SAT core alone enumerates fastest
+    solver.parameters.linearization_level = 0
+    # Enumerate all solutions on a single worker: with several workers CP-SAT may report
+    # the same solution once per worker and the enumeration is no longer exhaustive.
     solver.parameters.enumerate_all_solutions = True
-    solver.parameters.search_branching = cp_model.PORTFOLIO_SEARCH
+    solver.parameters.num_workers = 1
 
     # Display the first five solutions.
     solution_limit = 50000
-    solution_printer = TeamAllocationSolutionPrinter(games, benchVar, duoVar, num_players,
+    solution_printer = TeamAllocationSolutionPrinter(games, duoVar, num_players,
                                                     num_rounds, num_courts,
-                                                    solution_limit, f'groups_{fname}')
+                                                    solution_limit)
 
     # solve
     time_now = datetime.now().strftime("%H:%M:%S")
     print(f'{time_now} solving...' )
 
     solver.Solve(model, solution_printer)
+    # keep any previous groups file when no solution was printed
+    # (infeasible bench file or search stopped before the first solution)
+    if solution_printer.has_groups():
+        solution_printer.write_bench(f'groups_{fname}')
+    else:
+        print(f'No solution: groups_{fname} not written')
 
     # Statistics.
     print('\nSolver Statistics:')
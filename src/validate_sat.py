@@ -1,12 +1,13 @@
 #!/usr/bin/env python3
 import argparse
 from datetime import datetime
-from io import FileIO
 import json
 import math
-from operator import mod
-import random
-from ortools.sat.python import cp_model
+import mmap
+import re
+import sys
+import os
+import numpy as np
 
 """
 
@@ -19,6 +20,44 @@ Input:
     file containing set of players on bench on each round (outputed by bench_sat.py)
 
 """
+# player numbers in a fixed-width column of the prefinal file, ex: '[1, 5, 11, 12]     '
+PLAYERS = re.compile(rb'\d+')
+
+def same_players_count(court_of, num_courts):
+    """Count consecutive games (round, round+1) where a pair of players (p1<p2) plays on a same court
+    court_of[r, p] is the court of player p in round r (-1 when on bench)"""
+    # the last round is followed by the first one
+    court_next = np.roll(court_of, -1, axis=0)
+    both = (court_of >= 0) & (court_next >= 0)
+    # players sharing (court in round r, court in round r+1) make k*(k-1)/2 pairs
+    keys = (np.nonzero(both)[0]*num_courts + court_of[both])*num_courts + court_next[both]
+    common = np.bincount(keys)
+    return int((common*(common-1)//2).sum())
+
+def court_index(groups, num_players, num_courts):
+    """Return court_of[r, p], the court of player p in round r (-1 when on bench)
+    groups[r][c] lists the players on court c in round r (a bench entry may follow the courts)"""
+    # members[r, c, m]: player (from 0) of the m-th member of court c in round r
+    members = np.array([round[:num_courts] for round in groups], dtype=np.int64) - 1
+    court_of = np.full((len(groups), num_players), -1, dtype=np.int8)
+    court_of[np.arange(len(groups))[:, None, None], members] = np.arange(num_courts)[None, :, None]
+    return court_of
+
+def same_bench_count_packed(B):
+    """Count pairs of rounds (r1<r2) where a pair of players (p1<p2) is on bench together,
+    from bit-packed bench rounds (benchAlloc.same_bench_count counts the same with B @ B.T)
+    B[p, r] is 1 when player p sits on bench in round r"""
+    if B.shape[1] <= 64:
+        # bits[p]: bench rounds of player p packed in a single 64-bit word
+        bits = B.astype(np.uint64) @ (np.uint64(1) << np.arange(B.shape[1], dtype=np.uint64))
+        # pairs[p1, p2]: number of rounds players p1 and p2 sit on bench together (popcount of the AND)
+        pairs = np.bitwise_count(bits[:, None] & bits[None, :]).astype(np.int32)
+    else:
+        # bits[p]: bench rounds of player p packed 8 rounds per byte
+        bits = np.packbits(B.astype(bool), axis=1)
+        pairs = np.bitwise_count(bits[:, None, :] & bits[None, :, :]).sum(axis=2, dtype=np.int32)
+    return int(np.triu(pairs*(pairs-1)//2, 1).sum())
+
 class finalCourts:
     def __init__(self, fname, num_players, num_rounds, num_courts):
         self._fname = fname
@@ -33,7 +72,8 @@ class finalCourts:
         self._all_courts = range(num_courts+1)
         self._all_bench = range(num_courts+1,num_courts+1)
         self._benchcourt=num_courts  # last "court" is the bench
-        self._group_assignements = [[ [0 for x in self._all_players] for y in range(num_courts)] for z in self._all_rounds]
+        # self._court_of[r, p] is the court of player p in round r (-1 when on bench)
+        self._court_of = np.full((num_rounds, num_players), -1, dtype=np.int8)
         self._games = []
         self._best = num_rounds
         self._better = num_players
@@ -44,57 +84,40 @@ class finalCourts:
         with open(f'final_{self._fname}', 'r') as filehandle:
             self._games = json.load(filehandle)
         #print(self._games)
+        self._court_of = court_index(self._games, self._num_players, self._num_courts)
 
 
     def print_final_courts(self):
-        print(' '.ljust(14), ' '.join([f'court {i+1:2}'.ljust(19) for i in range(self._num_courts)]), 'bench'.ljust(10))
-        for round in range(self._num_rounds):
-            games = {}
-            for court in range(self._num_courts+1):
-                games[court]=self._games[round][f'{court}']
-            str_games = [f'{v}'.ljust(18) for v in games.values()]
-            print(f' Round {round+1:4}:  ', '  '.join(str_games) )
-
-        playersCourtCount={}
-
-        for court in range(self._num_courts):
-            playersCourtCount[court] = []
-            for player in range(self._num_players):
-                courtCount=0
-                for round in range(self._num_rounds):
-                    if player+1 in self._games[round][f'{court}']:
-                        courtCount=courtCount+1
-                        #print(round, court, group, player+1)
-                playersCourtCount[court].append(courtCount)
-            print(f' Court     {court+1:4}:  {playersCourtCount[court]}') 
+        P, R, C = self._num_players, self._num_rounds, self._num_courts
+        court_of, games = self._court_of, self._games
+        # lines to print, written to stdout at once
+        out = [' '.join([' '.ljust(14), ' '.join([f'court {i+1:2}'.ljust(19) for i in range(C)]), 'bench'.ljust(10)])]
+        # one column of 18 characters per court and for the bench
+        row = ' Round {:4}:   ' + '  '.join(['{:<18}']*(C+1))
+        for round in range(R):
+            out.append(row.format(round+1, *map(str, games[round])))
+
+        # playersCourtCount[c, p]: how often (count) player p plays on court c
+        rounds, players = np.nonzero(court_of >= 0)
+        # the int8 court index is widened before building the (court, player) keys
+        keys = court_of[rounds, players].astype(np.intp)*P + players
+        playersCourtCount = np.bincount(keys, minlength=C*P).reshape(C, P)
+        for court in range(C):
+            out.append(f' Court     {court+1:4}:  {playersCourtCount[court].tolist()}')
         
-        playersCourtDiffMax = []
-        for player in range(self._num_players):
-            maxCount = max(playersCourtCount[court][player] for court in range(self._num_courts))
-            minCount = min(playersCourtCount[court][player] for court in range(self._num_courts))
-            playersCourtDiffMax.append(maxCount-minCount)
-        self._better=playersCourtDiffMax.count(max(playersCourtDiffMax))
+        # playersCourtDiffMax[p]: difference between the max and min courtcount of player p
+        playersCourtDiffMax = np.ptp(playersCourtCount, axis=0)
+        courtDiffMax = int(playersCourtDiffMax.max())
+        self._better=int((playersCourtDiffMax == courtDiffMax).sum())
 
-        time_now = datetime.now().strftime("%H:%M:%S")
-        print(f' MaxDiff {max(playersCourtDiffMax):4}-{self._better}:  {playersCourtDiffMax}') 
+        out.append(f' MaxDiff {courtDiffMax:4}-{self._better}:  {playersCourtDiffMax.tolist()}')
+        sys.stdout.write('\n'.join(out)+'\n') 
             
         
 
 
     def print_player_stat(self):
-        sameplayers=0
-        for p1 in range(self._num_players):
-            for p2 in range(p1+1, self._num_players):
-                for round in range(self._num_rounds):
-                    roundn=mod(round+1,self._num_rounds)
-                    for court1 in range(self._num_courts):
-                        for court2 in range(self._num_courts):
-                            p1r1c1 = self._group_assignements[round][court1][p1]
-                            p2r1c1 = self._group_assignements[round][court1][p2]
-                            p1r2c2 = self._group_assignements[roundn][court2][p1]
-                            p2r2c2 = self._group_assignements[roundn][court2][p2]
-                            if p1r1c1+p2r1c1+p1r2c2+p2r2c2==4:
-                                sameplayers=sameplayers+1
+        sameplayers=same_players_count(self._court_of, self._num_courts)
 
         time_now = datetime.now().strftime("%H:%M:%S")
         print(f'{time_now} : consecutive games with same players: {sameplayers}')
@@ -113,49 +136,29 @@ class groupTeams:
         self._all_courts = range(num_courts+1)
         self._all_bench = range(num_courts+1,num_courts+1)
         self._benchcourt=num_courts  # last "court" is the bench
-        self._group_assignements = [[ [0 for x in self._all_players] for y in range(num_courts)] for z in self._all_rounds]
+        # self._court_of[r, p] is the court of player p in round r (-1 when on bench)
+        self._court_of = np.full((num_rounds, num_players), -1, dtype=np.int8)
         self._groups = []
 
     def read_team_groups(self):
         # Open the file and read the content in a list
         with open(f'groups_{self._fname}', 'r') as filehandle:
             self._groups = json.load(filehandle)
-
-        for round in self._all_rounds:
-            group_ass = self._groups[round]
-            for court in self._all_played_courts:
-                groupMembers=group_ass[f'{court}']
-                self._group_assignements[round][court][groupMembers[0]-1]=1
-                self._group_assignements[round][court][groupMembers[1]-1]=1
-                self._group_assignements[round][court][groupMembers[2]-1]=1
-                self._group_assignements[round][court][groupMembers[3]-1]=1
-        #print(self._group_assignements)
+        self._court_of = court_index(self._groups, self._num_players, self._num_courts)
+        #print(self._court_of)
         #print(self._groups)
 
     def print_team_groups(self):
         """Print team groups"""
-        print(' '.ljust(14), ' '.join([f'court {i+1:2}'.ljust(19) for i in range(self._num_courts)]))
+        # lines to print, written to stdout at once
+        out = [' '.join([' '.ljust(14), ' '.join([f'court {i+1:2}'.ljust(19) for i in range(self._num_courts)])])]
         for round in range(self._num_rounds):
-            games = {}
-            for court in range(self._num_courts):
-                games[court]=self._groups[round][f'{court}']
-            str_games = [f'{v}'.ljust(18) for v in games.values()]
-            print(f' Round {round+1:4}:  ', '  '.join(str_games) )
+            str_games = [f'{v}'.ljust(18) for v in self._groups[round]]
+            out.append(f' Round {round+1:4}:   ' + '  '.join(str_games))
+        sys.stdout.write('\n'.join(out)+'\n')
 
     def print_player_stat(self):
-        sameplayers=0
-        for p1 in range(self._num_players):
-            for p2 in range(p1+1, self._num_players):
-                for round in range(self._num_rounds):
-                    roundn=mod(round+1,self._num_rounds)
-                    for court1 in range(self._num_courts):
-                        for court2 in range(self._num_courts):
-                            p1r1c1 = self._group_assignements[round][court1][p1]
-                            p2r1c1 = self._group_assignements[round][court1][p2]
-                            p1r2c2 = self._group_assignements[roundn][court2][p1]
-                            p2r2c2 = self._group_assignements[roundn][court2][p2]
-                            if p1r1c1+p2r1c1+p1r2c2+p2r2c2==4:
-                                sameplayers=sameplayers+1
+        sameplayers=same_players_count(self._court_of, self._num_courts)
 
         time_now = datetime.now().strftime("%H:%M:%S")
         print(f'{time_now} : consecutive games with same players: {sameplayers}')
@@ -174,7 +177,8 @@ class benchGroup:
         self._all_courts = range(num_courts+1)
         self._all_bench = range(num_courts+1,num_courts+1)
         self._benchcourt=num_courts  # last "court" is the bench
-        self._bench_assignements=[ [ 0 for t in self._all_rounds] for p in self._all_players ]
+        # self._bench_assignements[p, r] is 1 when player p sits on bench in round r
+        self._bench_assignements=np.zeros((num_players, num_rounds), dtype=np.int8)
 
     def read_bench_groups(self):
         if self._num_bench>0:
@@ -188,45 +192,73 @@ class benchGroup:
             for y in self._all_rounds:
                 bench=[]
                 for z in range(self._num_bench):
-                    self._bench_assignements[bench_list[count]-1][y]=1
+                    self._bench_assignements[bench_list[count]-1, y]=1
                     count=count+1
 
     def print_bench(self):
         """Print the tournament schedule"""
-        print(' '.ljust(11), ' On bench')
+        # lines to print, written to stdout at once
+        out = [' '.ljust(11) + '  On bench']
         for round in range(self._num_rounds):
-            bench = []
-            for player in range(self._num_players):
-                if  self._bench_assignements[player][round]:
-                    bench.append(player+1)
-            print(f' round {round:4}:   {bench}' )
+            bench = (np.flatnonzero(self._bench_assignements[:, round])+1).tolist()
+            out.append(f' round {round:4}:   {bench}')
+        sys.stdout.write('\n'.join(out)+'\n')
 
     def print_bench_optimization(self):
-        sameplayers=0
-        for p1 in range(self._num_players):
-            for p2 in range(p1+1, self._num_players):
-                for t1 in range(self._num_rounds):
-                    for t2 in range(t1+1,self._num_rounds):
-                        p1t1 = self._bench_assignements[p1][t1]
-                        p2t1 = self._bench_assignements[p2][t1]
-                        p1t2 = self._bench_assignements[p1][t2]
-                        p2t2 = self._bench_assignements[p2][t2]
-                        if p1t1+p2t1+p1t2+p2t2 == 4:
-                            sameplayers=sameplayers+1
-                            #print(f' Players {p1:2}-{p2:2}-{p3:2}: round:{t1} games:{g1} \
-                            #    {p1t1g1}-{p2t1g1}-{p3t1g1} ')
+        sameplayers=same_bench_count_packed(self._bench_assignements)
         time_now = datetime.now().strftime("%H:%M:%S")
         print(f'{time_now} : bench with same players: {sameplayers}')
 
-        if 0:
-            for p1 in range(self._num_players):
-                for t1 in range(self._num_rounds):
-                    p1t1 = self._bench_assignements[p1][t1]
-                    for t2 in range(self._num_rounds-1):
-                        tn=mod(t1+1+t2,self._num_rounds)
-                        p1tn = self._bench_assignements[p1][tn]
-                        if p1t1==1 and p1tn==1:
-                            print(f' Players {p1:2}: round:{t1}-{tn} numconsec {abs(tn-t1)} ')
+def validate(fname, num_players, num_rounds, num_courts):
+    """Print the bench, groups and final courts files with their statistics"""
+    groupbench = benchGroup(fname, num_players, num_rounds, num_courts)
+    groupbench.read_bench_groups()
+    groupbench.print_bench()
+    groupbench.print_bench_optimization()
+
+    groupteam = groupTeams(fname, num_players, num_rounds, num_courts)
+    groupteam.read_team_groups()
+    groupteam.print_team_groups()
+    groupteam.print_player_stat()
+
+    finalcourts = finalCourts(fname, num_players, num_rounds, num_courts)
+    finalcourts.read_team_groups()
+    finalcourts.print_final_courts()
+
+def convert_prefinal(fname, num_courts):
+    """Convert the prefinal file (one printed round per line) into the final courts file"""
+    # convert the prefinal file line by line (one round per line) into a JSON list of rounds,
+    # reading the lines from a memory map of the file (an empty file cannot be mapped).
+    # Rounds are streamed into a temporary file that replaces final_{fname} only once
+    # the whole file is converted, so a bad line never leaves a truncated final file.
+    tmpname = f'final_{fname}.tmp'
+    try:
+        with open(f'prefinal_{fname}', 'rb') as f, open(tmpname, 'w') as filehandle:
+            filehandle.write('[')
+            if os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    rounds=0
+                    for num, line in enumerate(iter(mm.readline, b''), 1):
+                        # skip blank lines
+                        if not line.strip():
+                            continue
+                        # players of each court, then players on bench
+                        games=[[int(player) for player in PLAYERS.findall(line, 15+(court*20), 15+(court*20)+20)]
+                               for court in range(num_courts)]
+                        if not all(games):
+                            raise ValueError(f'prefinal_{fname}:{num}: missing players on a court: {line.decode().rstrip()}')
+                        games.append([int(player) for player in PLAYERS.findall(line, 15+(num_courts*20))])
+                        print(games)
+                        if rounds>0:
+                            filehandle.write(', ')
+                        json.dump(games, filehandle)
+                        rounds=rounds+1
+            filehandle.write(']')
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+    os.replace(tmpname, f'final_{fname}')
 
 def main():
     """Entry point of the program"""
@@ -251,6 +283,11 @@ def main():
                         default='bench.txt',
                         type=str,
                         help='filename for list of players on bench (default:bench.txt)')
+    parser.add_argument('--validate',
+                        '-v',
+                        action='store_true',
+                        help='print and check the bench, groups_ and final_ files instead of '
+                             'converting prefinal_ into final_')
     args = vars(parser.parse_args())
 
     # Data.
@@ -269,51 +306,10 @@ def main():
         print(f"min/max presence on bench is {min_bench} / {max_bench}")
         print(f"minimal distance on bench is {distance_on_bench}")
 
-
-    # Creates games variables.
-    all_players = range(num_players)
-    all_rounds = range(num_rounds)
-    all_played_courts = range(num_courts)
-    all_courts = range(num_courts+1)
-    all_bench = range(num_courts+1,num_courts+1)
-    benchcourt=num_courts  # last "court" is the bench
-
-    rand_players=list(range(num_players))
-    random.shuffle(rand_players)
-    benchVar = {}
-    duoVar = {}
-    games = {}
-
-    if 0:
-        groupbench = benchGroup(fname, num_players, num_rounds, num_courts)
-        groupbench.read_bench_groups()
-        groupbench.print_bench()
-        groupbench.print_bench_optimization()
-
-        groupteam = groupTeams(fname, num_players, num_rounds, num_courts)
-        groupteam.read_team_groups()
-        groupteam.print_team_groups()
-        groupteam.print_player_stat()
-
-        finalcourts = finalCourts(fname, num_players, num_rounds, num_courts)
-        finalcourts.read_team_groups()
-        finalcourts.print_final_courts()
+    if args['validate']:
+        validate(fname, num_players, num_rounds, num_courts)
     else:
-        with open(f'prefinal_{fname}', 'r') as f:
-                myfile = f.read().splitlines()
-
-        groups=[]
-        for i in range(len(myfile)):
-            games={}
-            for court in range(num_courts):
-                startix=15+(court*20)
-                games[f'{court}']=json.loads(myfile[i][startix:startix+20])
-            startix=15+(num_courts*20)
-            games[f'{num_courts}']=json.loads(myfile[i][startix:])
-            groups.append(games)
-        print(groups)
-        with open(f'final_{fname}', 'w') as filehandle: 
-            json.dump(groups, filehandle)
+        convert_prefinal(fname, num_courts)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file